@@ -3,67 +3,148 @@
 import argparse
 import base64
 import csv
+import functools
 import hashlib
+import io
 import itertools
-import json
 import logging
 import re
-import urllib.request
 
 from collections import Counter
 from datetime import datetime, time, timezone
+from email.utils import format_datetime
 from pathlib import Path
 
-from bs4 import BeautifulSoup
-from bs4 import SoupStrainer
 import dateparser
-from feedgen.feed import FeedGenerator
+from lxml import etree
+import orjson
+import urllib3
 
 from helper_fns import suburb_to_region
 
 EXPOSURE_URL = 'https://www.covid19.act.gov.au/act-status-and-response/act-covid-19-exposure-locations'
-CSV_REGEX = 'https://www[.]covid19[.]act[.]gov[.]au/.*?[.]csv'
+CSV_RE = re.compile(r'https://www[.]covid19[.]act[.]gov[.]au/[^"\'\s<>]*?[.]csv')
+RSS_DOCS = 'http://www.rssboard.org/rss-specification'
 FIELDS = ['Event Id', 'Status', 'Exposure Site', 'Street', 'Suburb', 'State', 'Date', 'Arrival Time', 'Departure Time', 'Contact']
+# Columns holding a time of day, shared by normalise and gen_desc so they agree on which fields are times
+TIME_FIELDS = frozenset(f for f in FIELDS if 'Time' in f)
 MIN_DATETIME = datetime(2020, 3, 11)
+TIME_RE = re.compile(r'^(\d{2})(\d{2})')
+WEEKDAY_SUFFIX_RE = re.compile(r'\s*-\s*[A-Za-z]+$')
+# Formats seen in the CSV, tried with strptime before falling back to the much slower dateparser
+DATE_FORMATS = ('%d/%m/%Y', '%d %B %Y')
+TIME_FORMATS = ('%I:%M%p', '%I:%M %p', '%H:%M')
 USER_AGENT = 'None'
+# Bump when gen_desc output changes so descriptions cached in the state get re-rendered
+STATE_VERSION = 1
+# Keys not shown in the RSS description
+DESC_SKIP = frozenset(['id', 'pubDate', 'desc'])
+# Returned by fetches when the server reports the resource unchanged since the cached validators
+NOT_MODIFIED = object()
+# Retry transient failures with backoff rather than losing the whole run
+# Ignore Retry-After as it is uncapped and could stall the scheduled job for hours
+RETRIES = urllib3.Retry(total=5, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                        allowed_methods=frozenset(['GET', 'HEAD']), respect_retry_after_header=False)
+# Without a timeout a stalled connection blocks forever and never gets retried
+TIMEOUT = urllib3.Timeout(connect=10, read=30)
+# Page and CSV are on the same host so share the keep-alive connection between fetches
+HTTP = urllib3.PoolManager(maxsize=2, retries=RETRIES, timeout=TIMEOUT,
+                           headers={'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip,deflate'})
+
+
+# Try the known formats, returns None if none match
+def _strptime(v, formats):
+    for fmt in formats:
+        try:
+            return datetime.strptime(v, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+# Dates and times repeat heavily across rows and dateparser is slow, so only parse each distinct string once
+@functools.lru_cache(maxsize=4096)
+def _parse_date(v):
+    # Usually 'DD/MM/YYYY - Weekday', the weekday is redundant
+    # Only strip a trailing word so anything else (e.g. a date range) still goes to dateparser
+    value = _strptime(WEEKDAY_SUFFIX_RE.sub('', v.strip()), DATE_FORMATS)
+    if value is None:
+        value = dateparser.parse(v, languages=['en'], settings={'DATE_ORDER': 'DMY'})
+    return value
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_time(v):
+    value = TIME_RE.sub(r'\1:\2', v.strip().strip('"'))
+    parsed = _strptime(value, TIME_FORMATS)
+    if parsed is None:
+        parsed = dateparser.parse(value, languages=['en'], settings={'DATE_ORDER': 'DMY'})
+    return parsed
+
+
+# Plain text normalisers, resolved once per column
+def _norm_site(v):
+    return v.strip().strip('"')
+
+
+def _norm_state(v):
+    return v.strip().upper().strip('"')
+
+
+def _norm_text(v):
+    return v.strip().title().strip('"')
+
+
+TEXT_NORMALISERS = {'Exposure Site': _norm_site, 'State': _norm_state}
 
 
 # Attempt to normalise data
-def normalise(locations):
+# Rows dropped for a Date after now are also appended to future if given, they become valid as time passes
+def normalise(locations, future=None):
     invalid = set()
     now = datetime.now()
-    time_re = re.compile(r'^(\d{2})(\d{2})')
     space_re = re.compile(r'\s{2,}')
-    for i, location in enumerate(locations):
-        for k, v in location.items():
-            # Could be a dict but reasonably complex and the less tying to field names the better
-            if k == 'Date':
-                value = dateparser.parse(v, languages=['en'], settings={'DATE_ORDER': 'DMY'})
+    # Work a column at a time so the branch for each field is picked once rather than per cell
+    # All rows come from the same CSV so share the same keys
+    columns = {k: [x[k] for x in locations] for k in (locations[0] if locations else ())}
+    for k, col in columns.items():
+        # Could be a dict but reasonably complex and the less tying to field names the better
+        if k == 'Date':
+            for i, v in enumerate(col):
+                if i in invalid:
+                    continue
+                value = _parse_date(v)
                 # If None or out of range add to set to delete and log warn
                 if value is None or value < MIN_DATETIME or value > now:
                     invalid.add(i)
-                    logging.warning("Invalid Date '%s' found in '%s'", v, location)
-                    break
+                    logging.warning("Invalid Date '%s' found in '%s'", v, locations[i])
+                    if value is not None and value > now and future is not None:
+                        future.append(locations[i])
+                    continue
                 # Could change to date for less characters, if so change gen_desc to use date
-                location[k] = value.isoformat()
-            elif 'Time' in k:
-                value = time_re.sub(r'\1:\2', v.strip().strip('"'))
-                value = dateparser.parse(value, languages=['en'], settings={'DATE_ORDER': 'DMY'})
+                col[i] = value.isoformat()
+        elif k in TIME_FIELDS:
+            for i, v in enumerate(col):
+                if i in invalid:
+                    continue
+                value = _parse_time(v)
                 # If None add to set to delete and log warn
                 if value is None:
                     invalid.add(i)
-                    logging.warning("Invalid Time '%s' found in '%s'", v, location)
-                    break
-                location[k] = value.time().isoformat()
-            elif k == 'Exposure Site':
-                location[k] = v.strip().strip('"')
-            elif k == 'State':
-                location[k] = v.strip().upper().strip('"')
-            else:
-                location[k] = v.strip().title().strip('"')
+                    logging.warning("Invalid Time '%s' found in '%s'", v, locations[i])
+                    continue
+                col[i] = value.time().isoformat()
+        else:
+            columns[k] = list(map(TEXT_NORMALISERS.get(k, _norm_text), col))
     if invalid:
         logging.warning("%d invalid records found", len(invalid))
-    for location in locations:
+    valid = []
+    for i, location in enumerate(locations):
+        if i in invalid:
+            continue
+        # Back to rows
+        for k, col in columns.items():
+            location[k] = col[i]
         # Remove case insensitive name from exposure name
         # removes redundant text and issues where continually add/remove suburb from common shop names
         # only remove from start or end
@@ -71,7 +152,8 @@ def normalise(locations):
         # Remove possible multiple white space in middle of string for mainly suburb removal but do it for everything
         for k, v in location.items():
             location[k] = space_re.sub(' ', v)
-    return [x for i, x in enumerate(locations) if i not in invalid]
+        valid.append(location)
+    return valid
 
 # Filter locations
 def filt(locations):
@@ -80,37 +162,65 @@ def filt(locations):
     #return [x for x in locations if x['Status'] != 'Archived']
     return {k: v for (k, v) in locations.items() if v['Status'] != 'Archived'}
 
+# GET url, sending If-None-Match/If-Modified-Since from cache if present
+# Returns NOT_MODIFIED on a 304, otherwise the body and updates cache with the new validators
+def fetch(url, cache=None):
+    # Per request headers replace the pool defaults rather than adding to them
+    headers = dict(HTTP.headers)
+    if cache is None:
+        cache = {}
+    if cache.get('etag'):
+        headers['If-None-Match'] = cache['etag']
+    if cache.get('last_modified'):
+        headers['If-Modified-Since'] = cache['last_modified']
+    response = HTTP.request('GET', url, headers=headers, preload_content=True)
+    if response.status == 304:
+        return NOT_MODIFIED
+    if response.status >= 400:
+        raise urllib3.exceptions.HTTPError(f"GET {url} failed with {response.status}")
+    cache['etag'] = response.headers.get('ETag')
+    cache['last_modified'] = response.headers.get('Last-Modified')
+    return response.data
+
+
 # Find CSV location, returns None if can't find it
-def find_csv_location():
-    # Still use soup to limit our searching
-    only_script = SoupStrainer("script")
-    csv_regex = re.compile(CSV_REGEX)
-    # TODO: Retry then fail
-    with urllib.request.urlopen(urllib.request.Request(EXPOSURE_URL, headers={'User-Agent':USER_AGENT})) as response:
-        html = response.read()
-        soup = BeautifulSoup(html, 'html.parser', parse_only=only_script)
-        for script in soup.find_all():
-            # TODO: Should only be one match
-            csv_location = csv_regex.search(''.join(list(script.contents)))
-            if csv_location is not None:
-                return csv_location[0]
-    return None
+# If the page is unchanged since cache was populated returns the previously found location
+def find_csv_location(cache=None):
+    if cache is None:
+        cache = {}
+    html = fetch(EXPOSURE_URL, cache)
+    if html is NOT_MODIFIED and cache.get('location'):
+        return cache['location']
+    if html is NOT_MODIFIED:
+        # Nothing to fall back on, fetch it properly
+        cache.clear()
+        html = fetch(EXPOSURE_URL, cache)
+    # Only after the URL so search the raw page rather than building a DOM to pull the scripts out
+    # TODO: Should only be one match
+    csv_location = CSV_RE.search(html.decode('utf-8', 'ignore'))
+    cache['location'] = csv_location[0] if csv_location is not None else None
+    return cache['location']
 
 
 # Grab and return the CSV, returns None if fails
-def get_csv(csv_location):
-    csv_data = None
-    # TODO: Retry then fail
-    with urllib.request.urlopen(csv_location) as response:
-        csv_data = response.read()
-    return csv_data
+# Returns NOT_MODIFIED if unchanged since cache was populated for the same location
+def get_csv(csv_location, cache=None):
+    if cache is None:
+        cache = {}
+    # Validators only apply to the file they were issued for
+    if cache.get('location') != csv_location:
+        cache.clear()
+        cache['location'] = csv_location
+    return fetch(csv_location, cache)
 
 
 # Generates locations based of CSV data
 def parse_csv(csv_data):
-    # Use reader rather than DictReader so can normalise fields
+    # Read the header with a plain reader so can normalise fields, then stream the rest through DictReader
+    # Values are stripped in normalise rather than here to avoid a second pass over every cell
     # TODO: Parsing error
-    rows = csv.reader(csv_data.splitlines())
+    f = io.StringIO(csv_data)
+    rows = csv.reader(f)
     locations = []
     try:
         fields = [x.strip().title() for x in next(rows)]
@@ -131,9 +241,10 @@ def parse_csv(csv_data):
         else:
             logging.error("Field mismatch")
             return None
-    for row in rows:
-        l = {fields[i]: row[i].strip() for i in range(len(fields))}
-        locations.append(l)
+    # Short rows are padded with empty values, the trailing empty columns end up under None so drop them
+    for row in csv.DictReader(f, fieldnames=fields, restval=''):
+        row.pop(None, None)
+        locations.append(row)
     return locations
 
 
@@ -144,13 +255,21 @@ def gen_id(locations):
     # Given we have no id to go by, if a new time slot added for the same location at the same day there is no way to
     # differentiate.
     # NOTE: Need to ensure python 3.7+ for insertion order remembering
-    # Use base64(MD5) to reduce size, could also remove base64 padding
+    # Use base64(BLAKE2b) truncated to 128 bits to reduce size, could also remove base64 padding
     ids = set()
     for location in locations:
-        digest = hashlib.md5('-'.join(list(location.values())[2:]).encode("utf-8")).digest()
-        loc_id = base64.b64encode(digest).decode("utf-8")
+        # Feed the values straight into the hash, same bytes as '-'.join() without building the list or string
+        h = hashlib.blake2b(digest_size=16)
+        for i, v in enumerate(itertools.islice(location.values(), 2, None)):
+            if i:
+                h.update(b'-')
+            h.update(v.encode("utf-8"))
+        loc_id = base64.b64encode(h.digest()).decode("ascii")
         location['id'] = loc_id
-        ids.add(loc_id) if loc_id not in ids else logging.warning("Duplicate detected %s", location)
+        if loc_id in ids:
+            logging.warning("Duplicate detected %s", location)
+        else:
+            ids.add(loc_id)
 
 # Add region to locations
 def gen_region(locations):
@@ -171,22 +290,28 @@ def parse_args(args=None):
     return parser.parse_args(args)
 
 
+# Format here so if we decide to change output wont spam rss
+# NOTE: much less overhead with datetime as in a format we know (hopefully)
+def _fmt_date(v):
+    return datetime.fromisoformat(v).strftime('%A, %d %B %Y')
+
+
+def _fmt_time(v):
+    return time.fromisoformat(v).strftime('%H%M')
+
+
+def _fmt_identity(v):
+    return v
+
+
+DESC_FORMATTERS = {'Date': _fmt_date, **dict.fromkeys(TIME_FIELDS, _fmt_time)}
+
+
 # Gen RSS description tag
 def gen_desc(loc):
-    desc = []
-    for k, v in loc.items():
-        # NOTE: Locks into RSS
-        if k not in ['id', 'pubDate']:
-            # Format here so if we decide to change output wont spam rss
-            # NOTE: much less overhead with datetime as in a format we know (hopefully)
-            if k == 'Date':
-                d = datetime.fromisoformat(v)
-                v = d.strftime('%A, %d %B %Y')
-            if 'Time' in k:
-                d = time.fromisoformat(v)
-                v = d.strftime('%H%M')
-            desc.append('<b>' + k + '</b>:' + v + '<br/>')
-    return ''.join(desc)
+    # NOTE: Locks into RSS
+    return ''.join(f'<b>{k}</b>:{DESC_FORMATTERS.get(k, _fmt_identity)(v)}<br/>'
+                   for k, v in loc.items() if k not in DESC_SKIP)
 
 
 # Check old RSS file if exists, if so keep original pubDate for any items
@@ -195,46 +320,75 @@ def update_state(existing, exposures, cur_time=None):
     """Update the state with new entries."""
     # Compare ids to last ones, anything that exists in old one we keep the old pubDate
     # If could reliably detect updates could set lastBuildDate
-    # TODO: This entire thing is still ugly/inefficient
     # Generate hash of locations for quick lookup
     exposure_guids = {x['id']: x for x in exposures}
-    # Delete old entries from state.
-    for guid in existing.keys() - exposure_guids:
+    # Delete old entries from state, need a copy of the keys as mutating
+    for guid in existing.keys() - exposure_guids.keys():
         del existing[guid]
-    cur_time = cur_time or datetime.utcnow().timestamp()
-    new_entries = exposure_guids.keys() - existing
-    for new_entry in new_entries:
-        loc = exposure_guids[new_entry]
+    cur_time = cur_time or datetime.now(timezone.utc).timestamp()
+    # Single pass over the exposures, anything not already in the state is new
+    new_entries = {guid: loc for guid, loc in exposure_guids.items() if guid not in existing}
+    for loc in new_entries.values():
         loc['pubDate'] = cur_time
-        existing[new_entry] = loc
+        # Render once here and keep in the state so unchanged entries aren't re-rendered every run
+        loc['desc'] = gen_desc(loc)
+    existing.update(new_entries)
 
     # Return the updated ids
-    return {x: exposure_guids[x] for x in new_entries}
+    return new_entries
+
+
+# Start an RSS document, returns the root and the channel to add items to
+# Fixed schema so build it directly rather than going through a feed library
+def new_rss(title):
+    rss = etree.Element('rss', version='2.0')
+    channel = etree.SubElement(rss, 'channel')
+    etree.SubElement(channel, 'title').text = title
+    etree.SubElement(channel, 'link').text = EXPOSURE_URL
+    etree.SubElement(channel, 'description').text = "Feed scraped from ACT exposure website"
+    etree.SubElement(channel, 'docs').text = RSS_DOCS
+    etree.SubElement(channel, 'lastBuildDate').text = format_datetime(datetime.now(timezone.utc))
+    return rss, channel
+
+
+# Add an item to an RSS channel, desc is already HTML so goes in as CDATA
+def add_item(channel, title, desc, guid, pub_date, link=None):
+    item = etree.SubElement(channel, 'item')
+    etree.SubElement(item, 'title').text = title
+    if link is not None:
+        etree.SubElement(item, 'link').text = link
+    etree.SubElement(item, 'description').text = etree.CDATA(desc)
+    etree.SubElement(item, 'guid', isPermaLink='false').text = guid
+    etree.SubElement(item, 'pubDate').text = format_datetime(pub_date)
+
+
+# Many entries share the same batch pubDate so only convert each timestamp once
+@functools.lru_cache(maxsize=256)
+def _ts_to_dt(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+# Serialise to UTF-8 bytes, written out as is to avoid a decode/encode round-trip over the whole feed
+def rss_bytes(rss):
+    return etree.tostring(rss, xml_declaration=True, encoding='UTF-8', pretty_print=True)
 
 
 # Build the RSS feed and write it to rss_file
 def gen_feed(locations):
-    fg = FeedGenerator()
-    pd = datetime.now(timezone.utc)
+    rss, channel = new_rss("ACT Exposure Locations")
     # Filter here in case break summary feed, don't want to use brain
     # TODO: Ideally done after normalise(), taking a while to sort now
     locations = filt(locations)
 
-    for loc in sorted(locations.values(), key=lambda x: (x['pubDate'], x['id']), reverse=True):
-        fe = fg.add_entry()
+    # Oldest first, the order feedgen's prepending add_entry produced from the newest first sort
+    for loc in sorted(locations.values(), key=lambda x: (x['pubDate'], x['id'])):
         # NOTE: These headers could easily change in data
         status = loc['Status'] if loc['Status'] else '?'
-        fe.title(f"({status}) {loc['Suburb']}:{loc['Exposure Site']}")
-        fe.content(gen_desc(loc), type='CDATA')
-        fe.guid(loc['id'])
         # NOTE: Locks into RSS
-        fe.pubDate(datetime.fromtimestamp(loc['pubDate']).replace(tzinfo=timezone.utc))
-    fg.title("ACT Exposure Locations")
-    fg.link(href=EXPOSURE_URL, rel='alternate')
-    fg.description("Feed scraped from ACT exposure website")
-    fg.lastBuildDate(pd)
+        add_item(channel, f"({status}) {loc['Suburb']}:{loc['Exposure Site']}", loc['desc'], loc['id'],
+                 _ts_to_dt(loc['pubDate']))
 
-    return fg.rss_str(pretty=True).decode('utf-8')
+    return rss_bytes(rss)
 
 def summarise_feed(locations):
     """Return a summary of new locations since the last update."""
@@ -244,29 +398,22 @@ def summarise_feed(locations):
         desc = [f"<b>{suburb}:</b>{count}<br/>" for (suburb,count) in counts.most_common()]
         return ''.join(desc)
 
-    fg = FeedGenerator()
-    pd = datetime.now(timezone.utc)
+    rss, channel = new_rss("ACT Exposure Summaries")
 
     locations = sorted(locations.values(), key=lambda x: (x['pubDate'], x['id']), reverse=True)
-    for pubDate, locs in itertools.groupby(locations, key=lambda x: x['pubDate']):
-        locs = list(locs)
-        fe = fg.add_entry()
-        # NOTE: This could easily change in data, possibly normalise in parsing?
-        fe.title(f"{len(locs)} additional exposure sites")
+    groups = [(pubDate, list(locs)) for pubDate, locs in itertools.groupby(locations, key=lambda x: x['pubDate'])]
+    # Oldest first, the order feedgen's prepending add_entry produced
+    # Rows within a group stay newest first as that decides the order of tied suburb counts
+    for pubDate, locs in reversed(groups):
         desc = summarise_group(locs)
-        fe.content(desc, type='CDATA')
-        digest = hashlib.md5(f"{pubDate}-{desc}".encode("utf-8")).digest()
+        digest = hashlib.blake2b(f"{pubDate}-{desc}".encode("utf-8"), digest_size=16).digest()
         guid = base64.b64encode(digest).decode("utf-8")
-        fe.guid(guid)
-        fe.link(href=EXPOSURE_URL)
+        # NOTE: This could easily change in data, possibly normalise in parsing?
         # NOTE: Locks into RSS
-        fe.pubDate(datetime.fromtimestamp(pubDate).replace(tzinfo=timezone.utc))
-    fg.title("ACT Exposure Summaries")
-    fg.link(href=EXPOSURE_URL, rel='alternate')
-    fg.description("Feed scraped from ACT exposure website")
-    fg.lastBuildDate(pd)
+        add_item(channel, f"{len(locs)} additional exposure sites", desc, guid, _ts_to_dt(pubDate),
+                 link=EXPOSURE_URL)
 
-    return fg.rss_str(pretty=True).decode('utf-8')
+    return rss_bytes(rss)
 
 
 def main():
@@ -277,34 +424,82 @@ def main():
     rss_summary_file = Path(args.prefix[0] + '_summary.rss')
     state_file = Path(args.prefix[0] + '_state.json')
     csv_file = Path(args.prefix[0] + '.csv')
+    meta_file = Path(args.prefix[0] + '_meta.json')
+
+    # HTTP validators and state version from the last run
+    meta = {}
+    if meta_file.is_file():
+        try:
+            meta = orjson.loads(meta_file.read_bytes())
+        except Exception as ex:
+            logging.error("Failed loading meta: %s", ex)
+
+    state = None
+    if state_file.is_file():
+        try:
+            state = orjson.loads(state_file.read_bytes())
+        except Exception as ex:
+            logging.error("Failed loading state: %s", ex)
+    outputs_exist = rss_file.is_file() and rss_summary_file.is_file()
+
+    # The unchanged shortcuts assume the last full run's output only depends on the upstream CSV, so skip them and
+    # always get a full run when forcing, building from a local CSV (next network run must rebuild from upstream),
+    # the state needs re-rendering, any output is missing or rows were only dropped for being dated in the future
+    # (they become valid with time, not with a CSV change)
+    if (args.force or args.csv is not None or meta.get('state_version') != STATE_VERSION or state is None
+            or not outputs_exist or meta.get('future_dates')):
+        meta.pop('html', None)
+        meta.pop('csv', None)
+        meta.pop('csv_hash', None)
+    if state is None:
+        state = {}
+    meta.setdefault('html', {})
+    meta.setdefault('csv', {})
 
     locations = []
     # Excel likes to add BOM hence -sig
     if args.csv is not None:
-        locations = parse_csv(args.csv.read())
+        with args.csv as f:
+            locations = parse_csv(f.read())
     else:
-        csv_location = find_csv_location()
+        csv_location = find_csv_location(meta['html'])
         logging.info("Found CSV location at: %s", csv_location)
-        csv_data = get_csv(csv_location)
+        csv_data = get_csv(csv_location, meta['csv'])
+        if csv_data is NOT_MODIFIED:
+            logging.info("CSV not modified, doing nothing")
+            meta_file.write_bytes(orjson.dumps(meta))
+            return
         logging.info("Loaded CSV")
+        # Servers don't always send validators, so also compare the content itself before doing any work
+        csv_hash = hashlib.blake2b(csv_data, digest_size=16).hexdigest()
+        if csv_hash == meta.get('csv_hash'):
+            logging.info("CSV unchanged, doing nothing")
+            meta_file.write_bytes(orjson.dumps(meta))
+            return
+        meta['csv_hash'] = csv_hash
         # Dump out CSV for debugging
         csv_file.write_bytes(csv_data)
         logging.info("Dumped CSV")
         locations = parse_csv(csv_data.decode("utf-8-sig"))
     logging.info("Found %d locations", len(locations))
-    locations = normalise(locations)
+    future = []
+    locations = normalise(locations, future)
+    meta['future_dates'] = bool(future)
     gen_id(locations)
     gen_region(locations)
 
-    state = {}
-    if state_file.is_file():
-        try:
-            with state_file.open(encoding='utf-8') as f:
-                state = json.load(f)
-        except Exception as ex:
-            logging.error("Failed loading state: %s", ex)
+    # Descriptions cached in the state are stale if the format has changed since they were rendered
+    stale = meta.get('state_version') != STATE_VERSION
+    if stale:
+        logging.info("State version changed, re-rendering descriptions")
+        for loc in state.values():
+            loc['desc'] = gen_desc(loc)
+        meta['state_version'] = STATE_VERSION
 
+    existing_ids = set(state)
     changes = update_state(state, locations)
+    # Entries can also disappear, e.g. when rebuilding from upstream after a local CSV
+    removed = existing_ids - state.keys()
 
     # Convert time, nice to standardise display as well as use later for geo
     # Time format could change at any time
@@ -318,20 +513,22 @@ def main():
     # Often readers are pretty unobtrusive in showing broken feeds
     # If error is in previous is feed then don't send it again
     # Consider what happens if error state toggles if send a 'everything is ok again' msg
-    if changes or args.force:
-        logging.info("Contents changed, %d new entries, regenerating feed", len(changes))
+    if changes or removed or stale or args.force or not outputs_exist:
+        logging.info("Contents changed, %d new entries, %d removed, regenerating feed", len(changes), len(removed))
         feed = gen_feed(state)
-        rss_file.write_text(feed, encoding="utf-8")
+        rss_file.write_bytes(feed)
 
         summary = summarise_feed(state)
-        rss_summary_file.write_text(summary, encoding="utf-8")
+        rss_summary_file.write_bytes(summary)
 
         # update state
-        with state_file.open('w', encoding='utf-8') as f:
-            json.dump(state, f)
+        state_file.write_bytes(orjson.dumps(state))
     else:
         logging.info("Contents unchanged, doing nothing")
 
+    # Only persist validators once the data they describe has been processed
+    meta_file.write_bytes(orjson.dumps(meta))
+
 
 if __name__ == '__main__':
     main()
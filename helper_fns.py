@@ -1,3 +1,4 @@
+import functools
 import re
 
 
@@ -47,14 +48,18 @@ CBR_REGIONS = {
 }
 
 
+_NON_WORD = re.compile(r'\W+')
+
+
 def normalise_suburb(suburb):
     """ Function for consistent normalisation before comparison """
-    return re.sub(r'[\W]+', '', suburb.lower())
+    return _NON_WORD.sub('', suburb.lower())
 
 
 __NORMALISED_CBR_REGIONS = {normalise_suburb(sub): region for region,suburbs in CBR_REGIONS.items() for sub in suburbs}
 
 
+@functools.lru_cache(maxsize=None)
 def suburb_to_region(suburb):
     """
     Maps CBR suburbs to CBR regions, suburbs sourced from https://en.wikipedia.org/wiki/List_of_Canberra_suburbs
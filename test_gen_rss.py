@@ -1,7 +1,16 @@
 import copy
 import io
+import tempfile
+import types
 import unittest
 
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+import dateparser
+import orjson
+
 
 
 import gen_rss
@@ -76,33 +85,32 @@ class TestParsingCSV(unittest.TestCase):
         dup = preprocess_locs(CSV_PARSED)
         state = {}
         gen_rss.update_state(state, dup)
-        out = gen_rss.gen_feed(state)
+        out = gen_rss.gen_feed(state).decode('utf-8')
 
         expected = """<?xml version='1.0' encoding='UTF-8'?>
-<rss xmlns:atom="http://www.w3.org/2005/Atom" xmlns:content="http://purl.org/rss/1.0/modules/content/" version="2.0">
+<rss version="2.0">
   <channel>
     <title>ACT Exposure Locations</title>
     <link>https://www.covid19.act.gov.au/act-status-and-response/act-covid-19-exposure-locations</link>
     <description>Feed scraped from ACT exposure website</description>
     <docs>http://www.rssboard.org/rss-specification</docs>
-    <generator>python-feedgen</generator>
     <lastBuildDate>Fri, 20 Aug 2021 14:53:44 +0000</lastBuildDate>
     <item>
-      <title>Nicholls:Gold Creek School (including Early Childhood Learning Centre)</title>
-      <description><![CDATA[<b>Arrival Time</b>:0800<br/><b>Contact</b>:Close<br/><b>Date</b>:Thursday, 12 August 2021<br/><b>Departure Time</b>:1510<br/><b>Event Id</b>:<br/><b>Exposure Site</b>:Gold Creek School (including Early Childhood Learning Centre)<br/><b>Region</b>:Gungahlin<br/><b>State</b>:ACT<br/><b>Status</b>:<br/><b>Street</b>:Kelleway Avenue<br/><b>Suburb</b>:Nicholls<br/>]]></description>
-      <guid isPermaLink="false">Bpk43ora2GlShwB6nKUZpg==</guid>
+      <title>(?) Fyshwick:Harvey Norman</title>
+      <description><![CDATA[<b>Arrival Time</b>:1000<br/><b>Contact</b>:Close<br/><b>Date</b>:Tuesday, 10 August 2021<br/><b>Departure Time</b>:1100<br/><b>Event Id</b>:<br/><b>Exposure Site</b>:Harvey Norman<br/><b>Region</b>:Inner South<br/><b>State</b>:ACT<br/><b>Status</b>:<br/><b>Street</b>:Barrier Street<br/><b>Suburb</b>:Fyshwick<br/>]]></description>
+      <guid isPermaLink="false">MeRRi7LVXyc7YUN1e6Gbaw==</guid>
       <pubDate>Fri, 20 Aug 2021 14:53:44 +0000</pubDate>
     </item>
     <item>
-      <title>Fyshwick:Harvey Norman</title>
-      <description><![CDATA[<b>Arrival Time</b>:1000<br/><b>Contact</b>:Close<br/><b>Date</b>:Tuesday, 10 August 2021<br/><b>Departure Time</b>:1100<br/><b>Event Id</b>:<br/><b>Exposure Site</b>:Harvey Norman<br/><b>Region</b>:Inner South<br/><b>State</b>:ACT<br/><b>Status</b>:<br/><b>Street</b>:Barrier Street<br/><b>Suburb</b>:Fyshwick<br/>]]></description>
-      <guid isPermaLink="false">iLODwJEKeYg5/3oi0CizTQ==</guid>
+      <title>(?) Fyshwick:Canberra Outlet Centre</title>
+      <description><![CDATA[<b>Arrival Time</b>:1400<br/><b>Contact</b>:Monitor<br/><b>Date</b>:Sunday, 08 August 2021<br/><b>Departure Time</b>:1530<br/><b>Event Id</b>:<br/><b>Exposure Site</b>:Canberra Outlet Centre<br/><b>Region</b>:Inner South<br/><b>State</b>:ACT<br/><b>Status</b>:<br/><b>Street</b>:377 Canberra Avenue<br/><b>Suburb</b>:Fyshwick<br/>]]></description>
+      <guid isPermaLink="false">TkanXihc2Rpe7MXv0ED//Q==</guid>
       <pubDate>Fri, 20 Aug 2021 14:53:44 +0000</pubDate>
     </item>
     <item>
-      <title>Fyshwick:Canberra Outlet Centre</title>
-      <description><![CDATA[<b>Arrival Time</b>:1400<br/><b>Contact</b>:Monitor<br/><b>Date</b>:Sunday, 08 August 2021<br/><b>Departure Time</b>:1530<br/><b>Event Id</b>:<br/><b>Exposure Site</b>:Canberra Outlet Centre<br/><b>Region</b>:Inner South<br/><b>State</b>:ACT<br/><b>Status</b>:<br/><b>Street</b>:377 Canberra Avenue<br/><b>Suburb</b>:Fyshwick<br/>]]></description>
-      <guid isPermaLink="false">oxT1t6ljYzDG0NBj4Hr6sw==</guid>
+      <title>(?) Nicholls:Gold Creek School (including Early Childhood Learning Centre)</title>
+      <description><![CDATA[<b>Arrival Time</b>:0800<br/><b>Contact</b>:Close<br/><b>Date</b>:Thursday, 12 August 2021<br/><b>Departure Time</b>:1510<br/><b>Event Id</b>:<br/><b>Exposure Site</b>:Gold Creek School (including Early Childhood Learning Centre)<br/><b>Region</b>:Gungahlin<br/><b>State</b>:ACT<br/><b>Status</b>:<br/><b>Street</b>:Kelleway Avenue<br/><b>Suburb</b>:Nicholls<br/>]]></description>
+      <guid isPermaLink="false">qrKTOZ6nUIMs3RsvvPYJjw==</guid>
       <pubDate>Fri, 20 Aug 2021 14:53:44 +0000</pubDate>
     </item>
   </channel>
@@ -117,22 +125,21 @@ class TestParsingCSV(unittest.TestCase):
         dup = preprocess_locs(CSV_PARSED)
         state = {}
         new = gen_rss.update_state(state, dup, cur_time=1)
-        res = gen_rss.summarise_feed(new)
+        res = gen_rss.summarise_feed(new).decode('utf-8')
 
         expected = """<?xml version='1.0' encoding='UTF-8'?>
-<rss xmlns:atom="http://www.w3.org/2005/Atom" xmlns:content="http://purl.org/rss/1.0/modules/content/" version="2.0">
+<rss version="2.0">
   <channel>
     <title>ACT Exposure Summaries</title>
     <link>https://www.covid19.act.gov.au/act-status-and-response/act-covid-19-exposure-locations</link>
     <description>Feed scraped from ACT exposure website</description>
     <docs>http://www.rssboard.org/rss-specification</docs>
-    <generator>python-feedgen</generator>
     <lastBuildDate>Fri, 20 Aug 2021 15:05:47 +0000</lastBuildDate>
     <item>
       <title>3 additional exposure sites</title>
       <link>https://www.covid19.act.gov.au/act-status-and-response/act-covid-19-exposure-locations</link>
       <description><![CDATA[<b>Fyshwick:</b>2<br/><b>Nicholls:</b>1<br/>]]></description>
-      <guid isPermaLink="false">QKtEQJFTu3kjlQbfIAXTcA==</guid>
+      <guid isPermaLink="false">C6zGZK2h6ReI02JsZ2YpkQ==</guid>
       <pubDate>Thu, 01 Jan 1970 10:00:01 +0000</pubDate>
     </item>
   </channel>
@@ -142,6 +149,176 @@ class TestParsingCSV(unittest.TestCase):
         expected = filter_rss(expected)
         self.assertEqual(res, expected)
 
+    def test_fast_date_parse_matches_dateparser(self):
+        # Ids are hashed from these values, any difference re-publishes entries
+        for v in ['10/08/2021 - Tuesday', '12 August 2021', '12 Aug 2021', '12/08/2021 - 13/08/2021']:
+            expected = dateparser.parse(v, languages=['en'], settings={'DATE_ORDER': 'DMY'})
+            res = gen_rss._parse_date(v)
+            self.assertEqual(res and res.isoformat(), expected and expected.isoformat(), v)
+
+    def test_fast_time_parse_matches_dateparser(self):
+        for v in ['8:00am', '3:10pm', '0800', '12:00am', '2:00 pm', '"10:00am"', 'noon']:
+            expected = dateparser.parse(gen_rss.TIME_RE.sub(r'\1:\2', v.strip().strip('"')),
+                                        languages=['en'], settings={'DATE_ORDER': 'DMY'})
+            self.assertEqual(gen_rss._parse_time(v).time(), expected.time(), v)
+
+
+CSV_URL = 'https://www.covid19.act.gov.au/__data/assets/text_file/0001/exposures.csv'
+
+
+def exposure_page(csv_url):
+    return f'<html><script>var data = "{csv_url}";</script></html>'.encode('utf-8')
+
+
+class FakeServer:
+    """Stands in for gen_rss.HTTP.request, answering 304 when the If-None-Match sent matches the ETag."""
+
+    def __init__(self):
+        self.resources = {}
+        self.requests = []
+
+    def set(self, url, data, etag=None):
+        self.resources[url] = (data, etag)
+
+    def request(self, method, url, headers=None, preload_content=True):
+        headers = headers or {}
+        self.requests.append((url, headers))
+        data, etag = self.resources[url]
+        if etag is not None and headers.get('If-None-Match') == etag:
+            return types.SimpleNamespace(status=304, headers={}, data=b'')
+        return types.SimpleNamespace(status=200, headers={'ETag': etag} if etag else {}, data=data)
+
+    def sent(self, url):
+        return [h for (u, h) in self.requests if u == url]
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.prefix = Path(tmp.name) / 'x'
+        self.server = FakeServer()
+        self.server.set(gen_rss.EXPOSURE_URL, exposure_page(CSV_URL), etag='"page1"')
+        self.server.set(CSV_URL, CSV_LINES.encode('utf-8'), etag='"csv1"')
+        patcher = mock.patch.object(gen_rss.HTTP, 'request', side_effect=self.server.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_main(self, *args):
+        """Run main() once, returns whether the CSV was parsed and the log output."""
+        self.server.requests.clear()
+        with mock.patch('sys.argv', ['gen_rss.py', *args, str(self.prefix)]), \
+                mock.patch.object(gen_rss, 'parse_csv', wraps=gen_rss.parse_csv) as parse, \
+                self.assertLogs(level='INFO') as logs:
+            gen_rss.main()
+        return parse.called, '\n'.join(logs.output)
+
+    def state(self):
+        return orjson.loads(Path(f'{self.prefix}_state.json').read_bytes())
+
+    def test_not_modified_skips_processing(self):
+        parsed, _ = self.run_main()
+        self.assertTrue(parsed)
+        self.assertEqual(len(self.state()), 3)
+        self.assertNotIn('If-None-Match', self.server.sent(CSV_URL)[0])
+
+        parsed, logs = self.run_main()
+        self.assertFalse(parsed)
+        self.assertIn("CSV not modified", logs)
+        self.assertEqual(self.server.sent(gen_rss.EXPOSURE_URL)[0]['If-None-Match'], '"page1"')
+        self.assertEqual(self.server.sent(CSV_URL)[0]['If-None-Match'], '"csv1"')
+
+    def test_page_not_modified_uses_cached_location(self):
+        self.run_main()
+        self.server.set(CSV_URL, CSV_LINES.replace('Close\n', 'Casual\n', 1).encode('utf-8'), etag='"csv2"')
+
+        parsed, _ = self.run_main()
+        self.assertTrue(parsed)
+        # Page answered 304 yet the CSV was still requested from the location found last time
+        self.assertEqual(len(self.server.sent(gen_rss.EXPOSURE_URL)), 1)
+        self.assertEqual(self.server.sent(CSV_URL)[0]['If-None-Match'], '"csv1"')
+        self.assertEqual(len(self.state()), 3)
+
+    def test_location_change_resets_validators(self):
+        self.run_main()
+        new_url = CSV_URL.replace('exposures', 'exposures2')
+        self.server.set(gen_rss.EXPOSURE_URL, exposure_page(new_url), etag='"page2"')
+        self.server.set(new_url, CSV_LINES.encode('utf-8'), etag='"csv1"')
+
+        parsed, _ = self.run_main()
+        self.assertFalse(self.server.sent(CSV_URL))
+        self.assertNotIn('If-None-Match', self.server.sent(new_url)[0])
+        # Same CSV so caught by the content hash instead
+        self.assertFalse(parsed)
+
+    def test_force_drops_validators(self):
+        self.run_main()
+        parsed, _ = self.run_main('-f')
+        self.assertTrue(parsed)
+        self.assertNotIn('If-None-Match', self.server.sent(gen_rss.EXPOSURE_URL)[0])
+        self.assertNotIn('If-None-Match', self.server.sent(CSV_URL)[0])
+
+    def test_state_version_change_drops_validators(self):
+        self.run_main()
+        with mock.patch.object(gen_rss, 'STATE_VERSION', gen_rss.STATE_VERSION + 1):
+            parsed, logs = self.run_main()
+        self.assertTrue(parsed)
+        self.assertIn("State version changed", logs)
+        self.assertNotIn('If-None-Match', self.server.sent(CSV_URL)[0])
+
+    def test_local_csv_drops_validators(self):
+        self.run_main()
+        local = Path(f'{self.prefix}_local.csv')
+        local.write_text(CSV_LINES + ",,Local Only Site,Some Street,Nicholls,ACT,12/08/2021,8:00am,9:00am,Close\n",
+                         encoding='utf-8')
+        self.run_main('--csv', str(local))
+        self.assertEqual(len(self.state()), 4)
+
+        # Upstream hasn't changed but the feed was built from the local CSV so must be rebuilt
+        parsed, _ = self.run_main()
+        self.assertTrue(parsed)
+        self.assertNotIn('If-None-Match', self.server.sent(CSV_URL)[0])
+        self.assertEqual(len(self.state()), 3)
+
+    def test_hash_shortcut_without_validators(self):
+        self.server.set(gen_rss.EXPOSURE_URL, exposure_page(CSV_URL))
+        self.server.set(CSV_URL, CSV_LINES.encode('utf-8'))
+        self.run_main()
+
+        parsed, logs = self.run_main()
+        self.assertFalse(parsed)
+        self.assertIn("CSV unchanged", logs)
+
+    def test_missing_outputs_skip_shortcuts(self):
+        self.run_main()
+        Path(f'{self.prefix}_state.json').unlink()
+        Path(f'{self.prefix}.rss').unlink()
+
+        parsed, _ = self.run_main()
+        self.assertTrue(parsed)
+        self.assertNotIn('If-None-Match', self.server.sent(CSV_URL)[0])
+        self.assertEqual(len(self.state()), 3)
+        self.assertTrue(Path(f'{self.prefix}.rss').is_file())
+
+    def test_future_dates_skip_shortcuts(self):
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime('%d/%m/%Y')
+        csv_lines = CSV_LINES + f",,Future Site,Some Street,Nicholls,ACT,{tomorrow},8:00am,9:00am,Close\n"
+        self.server.set(CSV_URL, csv_lines.encode('utf-8'), etag='"csv1"')
+        self.run_main()
+        self.assertEqual(len(self.state()), 3)
+
+        class Later(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.now(tz) + timedelta(days=2)
+
+        with mock.patch.object(gen_rss, 'datetime', Later):
+            parsed, _ = self.run_main()
+        self.assertTrue(parsed)
+        self.assertNotIn('If-None-Match', self.server.sent(CSV_URL)[0])
+        self.assertEqual(len(self.state()), 4)
+
 
 if __name__ == "__main__":
     unittest.main()